@@ -1,21 +1,33 @@
 # app.py
-import os, math, json, datetime as dt
+import os, atexit, threading, datetime as dt
 import numpy as np
 import pandas as pd
 import streamlit as st
-import psycopg
+import orjson
+from psycopg.types.json import Jsonb, set_json_dumps, set_json_loads
+from psycopg_pool import ConnectionPool
 from dotenv import load_dotenv
 from pytrends.request import TrendReq  # only for related queries (optional)
+from momentum import momentum_stats
 
 load_dotenv()
+# boards.niches is JSONB: orjson on Save and on every Load
+set_json_dumps(orjson.dumps); set_json_loads(orjson.loads)
 DATABASE_URL = os.getenv("DATABASE_URL")
 DEFAULT_GEO = os.getenv("DEFAULT_GEO", "")
 SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL","")
 
 st.set_page_config(page_title="Niche Trend Radar", layout="wide")
 
+@st.cache_resource
+def pool():
+    # one pool per server process, shared by every session and rerun
+    p = ConnectionPool(DATABASE_URL, min_size=2, max_size=10, kwargs={"autocommit": True}, open=True)
+    atexit.register(p.close)
+    return p
+
 def db():
-    return psycopg.connect(DATABASE_URL, autocommit=True)
+    return pool().connection()
 
 # --- boards table ---
 DDL = """
@@ -36,56 +48,95 @@ DEFAULT_NICHES = [
     "Online Learning","Freelancing","Online Communities"
 ]
 
-def load_points(niches, start, end, geo, timeframes):
+def fetch_frame(q, params, columns):
+    with db() as conn, conn.cursor(binary=True) as cur:
+        cur.execute(q, params)
+        rows = cur.fetchall()
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    df["value"] = df["value"].astype(np.float64)
+    return df
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_interest(niches, start, end, geo, timeframe):
+    """Google Trends interest (niche, date, value) from the daily rollup."""
     q = """
-    SELECT source,niche,date,metric,value,geo,timeframe
-    FROM trend_points
-    WHERE niche = ANY(%s) AND date BETWEEN %s AND %s AND geo = %s AND timeframe = ANY(%s)
+    SELECT niche,date,value
+    FROM mv_trend_daily
+    WHERE metric = 'interest' AND niche = ANY(%s) AND date BETWEEN %s AND %s AND geo = %s AND timeframe = %s
     """
-    with db() as conn:
-        df = pd.read_sql(q, conn, params=(niches, start, end, geo, timeframes), parse_dates=["date"])
+    df = fetch_frame(q, (list(niches), start, end, geo, timeframe), ["niche","date","value"])
+    df["date"] = pd.to_datetime(df["date"])
     return df
 
+@st.cache_data(ttl=300, show_spinner=False)
+def load_metrics(niches, start, end, geo, timeframe="last_7d"):
+    """Cross-source counts (niche, metric, value) from the daily rollup."""
+    q = """
+    SELECT niche,metric,value
+    FROM mv_trend_daily
+    WHERE metric <> 'interest' AND niche = ANY(%s) AND date BETWEEN %s AND %s AND geo = %s AND timeframe = %s
+    """
+    return fetch_frame(q, (list(niches), start, end, geo, timeframe), ["niche","metric","value"])
+
+def frame_hash(d):
+    return pd.util.hash_pandas_object(d, index=True).values.tobytes()
+
+def align_to_last_obs(R):
+    """ffill each column and shift it so its own last observation is the last row."""
+    # a niche that stopped early (e.g. failed pytrends group) keeps its own trailing window
+    T = len(R)
+    F = pd.DataFrame(R).ffill().to_numpy()
+    valid = ~np.isnan(R)
+    last = np.where(valid.any(axis=0), T - 1 - np.argmax(valid[::-1], axis=0), T - 1)
+    src = np.arange(T)[:, None] - (T - 1 - last)[None, :]
+    out = np.take_along_axis(F, np.clip(src, 0, None), axis=0)
+    out[src < 0] = np.nan
+    return out
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: frame_hash})
 def compute_momentum(gt_df):
-    if gt_df.empty: return pd.DataFrame(columns=["niche","wow_pct","slope7","zscore90","gt_score"])
-    df = gt_df.copy()
-    df["date"] = pd.to_datetime(df["date"])
-    stats=[]
-    for niche, g in df.groupby("niche"):
-        g = g.sort_values("date").set_index("date").asfreq("D").fillna(method="ffill")
-        series = g["value"].values
-        if len(series) < 14:
-            stats.append({"niche":niche,"wow_pct":np.nan,"slope7":np.nan,"zscore90":np.nan,"gt_score":np.nan})
-            continue
-        cur7 = np.nanmean(series[-7:])
-        prev7 = np.nanmean(series[-14:-7])
-        wow = (cur7 - prev7)/prev7 if prev7 and not math.isclose(prev7,0) else np.nan
-        # slope
-        m = np.polyfit(np.arange(7), series[-7:], 1)[0]
-        # z vs 90 (cap by length)
-        base = series[-90:] if len(series)>=90 else series
-        z = (cur7 - np.nanmean(base))/ (np.nanstd(base) if np.nanstd(base)>0 else np.nan)
-        score = np.nansum([np.tanh(wow)*0.45 if not np.isnan(wow) else 0,
-                           np.tanh(m/10)*0.35 if not np.isnan(m) else 0,
-                           np.tanh(z/3)*0.20 if not np.isnan(z) else 0])
-        stats.append({"niche":niche,"wow_pct":wow,"slope7":m,"zscore90":z,"gt_score":float(score)})
-    return pd.DataFrame(stats).sort_values("gt_score", ascending=False)
-
-def normalize(x):
-    if len(x)==0: return x
-    mn, mx = min(x), max(x)
-    return [(v-mn)/(mx-mn) if mx>mn else 0 for v in x]
-
+    cols = ["niche","wow_pct","slope7","zscore90","gt_score"]
+    if gt_df.empty: return pd.DataFrame(columns=cols)
+    assert pd.api.types.is_datetime64_any_dtype(gt_df["date"]), "load_interest parses date"
+    # one (T, K) matrix instead of a Python loop over niches
+    pivot = gt_df.pivot_table(index="date", columns="niche", values="value", observed=True)
+    full_idx = pd.date_range(gt_df["date"].min(), gt_df["date"].max(), freq="D")
+    P = align_to_last_obs(pivot.reindex(full_idx).to_numpy(dtype=np.float64, copy=False))
+    if len(P) < 14:
+        return pd.DataFrame({"niche":pivot.columns, "wow_pct":np.nan, "slope7":np.nan,
+                             "zscore90":np.nan, "gt_score":np.nan})[cols]
+    wow, slope, z, score = momentum_stats(P)
+    out = pd.DataFrame({"niche":pivot.columns, "wow_pct":wow, "slope7":slope, "zscore90":z, "gt_score":score})
+    return out[cols].sort_values("gt_score", ascending=False)
+
+FUSE_WEIGHTS = pd.Series({"gt_score":0.6,"views_7d":0.20,"posts_7d":0.12,"articles_7d":0.08,"stories_7d":0.05})
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: frame_hash})
 def fuse_scores(momentum, metrics_df):
     """Fuse GT score + YouTube/Reddit/News/HN counts (normalized)."""
     base = momentum.set_index("niche")[["gt_score"]]
     piv = metrics_df.pivot_table(index="niche", columns="metric", values="value", aggfunc="sum").fillna(0)
-    for col in piv.columns:
-        piv[col] = normalize(piv[col].tolist())
+    # min-max per column in one shot; constant columns -> 0
+    mn = piv.min()
+    piv = ((piv - mn) / (piv.max() - mn).replace(0, np.nan)).fillna(0)
     fused = base.join(piv, how="outer").fillna(0)
-    fused["fused_score"] = 0.6*fused["gt_score"] + 0.20*fused.get("views_7d",0) + 0.12*fused.get("posts_7d",0) + 0.08*fused.get("articles_7d",0) + 0.05*fused.get("stories_7d",0)
+    w = FUSE_WEIGHTS[FUSE_WEIGHTS.index.intersection(fused.columns)]
+    fused["fused_score"] = fused[w.index].mul(w, axis=1).sum(axis=1)
     return fused.sort_values("fused_score", ascending=False).reset_index()
 
+@st.cache_resource
+def trends_client():
+    # one pytrends session shared across reruns; payload state is per-call, hence the lock
+    return TrendReq(hl="en-US", tz=360), threading.Lock()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def related_rising(top, timeframe, geo):
+    py, lock = trends_client()
+    with lock:
+        py.build_payload([top], timeframe=timeframe, geo=geo)
+        rq = py.related_queries()
+    return rq[top]["rising"]
+
 def send_slack(text):
     if not SLACK_WEBHOOK_URL: return
     try:
@@ -118,7 +169,7 @@ with st.sidebar:
             if st.button("Save"):
                 with db() as conn:
                     conn.execute("INSERT INTO boards(name,niches,geo,timeframe) VALUES (%s,%s,%s,%s) ON CONFLICT (name) DO UPDATE SET niches=EXCLUDED.niches, geo=EXCLUDED.geo, timeframe=EXCLUDED.timeframe",
-                                 (board_name, json.dumps(niches), geo, timeframe))
+                                 (board_name, Jsonb(niches), geo, timeframe))
                 st.success(f"Saved board: {board_name}")
 
     start = st.date_input("Start", dt.date.today()-dt.timedelta(days=7))
@@ -128,18 +179,19 @@ with st.sidebar:
 st.title("📊 Niche Trend Radar — PM View")
 
 # --- Load data from Postgres (collected by ingest.py) ---
-df = load_points(niches, start, end, geo, [timeframe, f"last_7d"])
-gt = df[(df["source"]=="google_trends") & (df["metric"]=="interest")].copy()
-metrics = df[(df["source"]!="google_trends")].copy()
+gt = load_interest(tuple(niches), start, end, geo, timeframe).sort_values("date")
+gt["niche"] = gt["niche"].astype("category")
+metrics = load_metrics(tuple(niches), start, end, geo)
 
 # --- Charts ---
 if not gt.empty:
     st.subheader("Google Trends — Interest Over Time")
-    pivot = gt.pivot_table(index="date", columns="niche", values="value")
+    # (date, niche) is unique per the PK, so a plain pivot skips pivot_table's aggregation
+    pivot = gt.pivot(index="date", columns="niche", values="value")
     st.line_chart(pivot)
 
 st.subheader("Momentum & Breakouts")
-momentum = compute_momentum(gt.rename(columns={"value":"value"})) if not gt.empty else pd.DataFrame()
+momentum = compute_momentum(gt) if not gt.empty else pd.DataFrame()
 st.dataframe(momentum, use_container_width=True)
 
 st.subheader("Cross-source (YouTube / Reddit / News / HN) + Fused Score")
@@ -172,10 +224,7 @@ if not momentum.empty:
     try:
         top = momentum.iloc[0]["niche"]
         st.markdown(f"#### Related rising queries — **{top}**")
-        py = TrendReq(hl="en-US", tz=360)
-        py.build_payload([top], timeframe=timeframe, geo=geo)
-        rq = py.related_queries()
-        rising = rq[top]["rising"]
+        rising = related_rising(top, timeframe, geo)
         if rising is not None:
             st.dataframe(rising.rename(columns={"query":"term","value":"score"}).head(10))
     except Exception:
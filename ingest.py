@@ -1,15 +1,23 @@
 # ingest.py
-import os, time, json, math, datetime as dt
+import os, time, math, atexit, asyncio, threading, datetime as dt
 from urllib.parse import urlencode
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
 import requests
-import pandas as pd
+import httpx
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import numpy as np
 from dotenv import load_dotenv
 from pytrends.request import TrendReq
 from pytrends.exceptions import TooManyRequestsError, ResponseError
-import psycopg
+import orjson
+from psycopg.types.json import Jsonb, set_json_dumps, set_json_loads
+from psycopg_pool import ConnectionPool
 
 load_dotenv()
+# collect_runs.niches (JSONB) is encoded with orjson
+set_json_dumps(orjson.dumps); set_json_loads(orjson.loads)
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
@@ -28,6 +36,42 @@ NICHES = [
 TIMEFRAME = "now 7-d"   # also collect "today 3-m" if you want
 SUBREDDITS = ["SaaS","Entrepreneur","startups","nocode","SideProject","marketing","YouTubeCreators"]
 DAYS = 7
+WORKERS = 8
+
+# ---- HTTP session (shared across threads; keep-alive + backoff on 429/5xx) ----
+RETRY_STATUS = (429,500,502,503,504)
+http = requests.Session()
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16,
+                       max_retries=Retry(total=3, backoff_factor=1, status_forcelist=RETRY_STATUS,
+                                         allowed_methods=("GET",)))
+http.mount("https://", _adapter); http.mount("http://", _adapter)
+
+def retry_after(r):
+    """Seconds from a Retry-After header (delta or HTTP date), or None."""
+    h = r.headers.get("Retry-After")
+    if not h: return None
+    try:
+        return max(float(h), 0.0)
+    except ValueError:
+        try:
+            return max((parsedate_to_datetime(h) - dt.datetime.now(dt.timezone.utc)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+async def get_json(client, url, params=None, retries=3):
+    """GET on the shared async client with the same 429/5xx backoff as the sync session."""
+    for attempt in range(retries + 1):
+        try:
+            r = await client.get(url, params=params)
+        except httpx.TransportError:  # connect errors / timeouts, like Retry(total=...)
+            if attempt == retries: raise
+            await asyncio.sleep(2**attempt); continue
+        if r.status_code not in RETRY_STATUS:
+            return r.json()
+        if attempt == retries:
+            r.raise_for_status()  # log the HTTP error, not a JSON decode of its body
+        wait = retry_after(r)
+        await asyncio.sleep(min(wait if wait is not None else 2**attempt, 60))
 
 # ---- DB helpers ----
 DDL = """
@@ -42,6 +86,16 @@ CREATE TABLE IF NOT EXISTS trend_points(
   created_at TIMESTAMPTZ DEFAULT now(),
   PRIMARY KEY (source,niche,date,metric,geo,timeframe)
 );
+-- the dashboard reads mv_trend_daily, so trend_points only needs its PK for the upserts
+DROP INDEX IF EXISTS ix_trend_points_nqtd;
+DROP INDEX IF EXISTS ix_trend_points_date;
+
+-- daily rollup read by the dashboard (one metric per source, so source can be dropped);
+-- ux_mv_trend_daily serves its niche/metric/geo/date/timeframe filter
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_trend_daily AS
+  SELECT niche, metric, geo, date, timeframe, sum(value) AS value
+  FROM trend_points GROUP BY 1,2,3,4,5;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_trend_daily ON mv_trend_daily (niche, metric, geo, date, timeframe);
 
 CREATE TABLE IF NOT EXISTS collect_runs(
   id BIGSERIAL PRIMARY KEY,
@@ -55,153 +109,206 @@ CREATE TABLE IF NOT EXISTS collect_runs(
 );
 """
 
+POOL = ConnectionPool(DATABASE_URL, min_size=2, max_size=10, kwargs={"autocommit": True}, open=True)
+atexit.register(POOL.close)
+
 def db():
-    return psycopg.connect(DATABASE_URL, autocommit=True)
+    return POOL.connection()
 
 def ensure_schema():
     with db() as conn:
         conn.execute(DDL)
 
+POINT_COLS = ("source","niche","date","metric","value","geo","timeframe")
+POINT_KEY = ("source","niche","date","metric","geo","timeframe")
+
 def upsert_points(rows):
+    """COPY rows into a temp stage, then upsert in one statement (1 round-trip vs N)."""
     if not rows: return
-    with db() as conn:
+    # hourly trends collapse to one date per key: keep the last row, as the old
+    # per-row upsert did (ON CONFLICT can't touch a key twice in one statement)
+    rows = {tuple(r[c] for c in POINT_KEY): r for r in rows}.values()
+    cols = ",".join(POINT_COLS)
+    with db() as conn, conn.transaction():
         with conn.cursor() as cur:
-            cur.executemany("""
-            INSERT INTO trend_points(source,niche,date,metric,value,geo,timeframe)
-            VALUES (%(source)s,%(niche)s,%(date)s,%(metric)s,%(value)s,%(geo)s,%(timeframe)s)
+            cur.execute("CREATE TEMP TABLE trend_points_stage (LIKE trend_points INCLUDING DEFAULTS) ON COMMIT DROP")
+            with cur.copy(f"COPY trend_points_stage ({cols}) FROM STDIN") as cp:
+                for r in rows:
+                    cp.write_row(tuple(r[c] for c in POINT_COLS))
+            cur.execute(f"""
+            INSERT INTO trend_points({cols})
+            SELECT {cols} FROM trend_points_stage
             ON CONFLICT (source,niche,date,metric,geo,timeframe)
             DO UPDATE SET value=EXCLUDED.value, created_at=now()
-            """, rows)
+            """)
 
 def log_run(source, status="ok", error=""):
     with db() as conn:
         conn.execute(
             "INSERT INTO collect_runs(source,niches,timeframe,geo,status,error) VALUES (%s,%s,%s,%s,%s,%s)",
-            (source, json.dumps(NICHES), TIMEFRAME, DEFAULT_GEO, status, error)
+            (source, Jsonb(NICHES), TIMEFRAME, DEFAULT_GEO, status, error)
         )
 
 # ---- Google Trends ----
 def fetch_google_trends(niches, timeframe=TIMEFRAME, geo=DEFAULT_GEO):
-    py = TrendReq(hl="en-US", tz=360)
-    rows=[]
+    local = threading.local()  # TrendReq keeps per-payload state -> one client per thread
     def chunks(lst,n): 
         for i in range(0,len(lst),n): yield lst[i:i+n]
-    for group in chunks(niches,5):
+    def one(group):
+        if not hasattr(local, "py"): local.py = TrendReq(hl="en-US", tz=360)
         attempts=0
         while True:
             try:
-                py.build_payload(group, timeframe=timeframe, geo=geo)
-                df = py.interest_over_time().reset_index(names="date")
-                if df.empty: break
-                for _, r in df.iterrows():
-                    d = pd.to_datetime(r["date"]).date().isoformat()
-                    for n in group:
-                        val = float(r.get(n, 0)) if not pd.isna(r.get(n, np.nan)) else 0.0
-                        rows.append({"source":"google_trends","niche":n,"date":d,"metric":"interest",
-                                     "value":val,"geo":geo,"timeframe":timeframe})
-                break
+                local.py.build_payload(group, timeframe=timeframe, geo=geo)
+                df = local.py.interest_over_time().reset_index(names="date")
+                if df.empty: return []
+                # one typed (T, G) array; niches pytrends dropped come back as 0
+                dates = df["date"].dt.date.astype(str).tolist()
+                vals = np.nan_to_num(df.reindex(columns=group).to_numpy(dtype=np.float64), nan=0.0).tolist()
+                return [{"source":"google_trends","niche":n,"date":d,"metric":"interest",
+                         "value":v,"geo":geo,"timeframe":timeframe}
+                        for d, vrow in zip(dates, vals) for n, v in zip(group, vrow)]
             except (TooManyRequestsError, ResponseError):
                 attempts += 1
                 time.sleep(min(2**attempts, 60))
             except Exception as e:
-                log_run("google_trends","error",str(e)); break
+                log_run("google_trends","error",str(e)); return []
+    # small pool: pytrends is rate limited
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        rows = [r for group_rows in ex.map(one, list(chunks(niches,5))) for r in group_rows]
     upsert_points(rows); log_run("google_trends")
 
 # ---- YouTube (official API) ----
-def yt_views_for_query(q, days=DAYS):
-    # 1) search videos in last N days
+async def yt_search_ids(client, q, days=DAYS):
+    # search videos in last N days
     published_after=(dt.datetime.utcnow()-dt.timedelta(days=days)).isoformat("T")+"Z"
     search_params = {
         "part":"id", "type":"video", "q":q,
         "maxResults": 25, "order":"date",
         "publishedAfter": published_after, "key": YOUTUBE_API_KEY
     }
-    s = requests.get("https://www.googleapis.com/youtube/v3/search", params=search_params, timeout=30).json()
-    ids = [it["id"]["videoId"] for it in s.get("items",[])]
-    if not ids: return 0
-    # 2) fetch stats
+    s = await get_json(client, "https://www.googleapis.com/youtube/v3/search", search_params)
+    return [it["id"]["videoId"] for it in s.get("items",[])]
+
+async def yt_view_counts(client, ids):
+    # videos.list takes up to 50 ids per call
     stats_params = {"part":"statistics", "id":",".join(ids), "key":YOUTUBE_API_KEY}
-    v = requests.get("https://www.googleapis.com/youtube/v3/videos", params=stats_params, timeout=30).json()
-    views = sum(int(it["statistics"].get("viewCount","0")) for it in v.get("items",[]))
-    return views
+    v = await get_json(client, "https://www.googleapis.com/youtube/v3/videos", stats_params)
+    return {it["id"]: int(it["statistics"].get("viewCount","0")) for it in v.get("items",[])}
 
-def fetch_youtube(niches):
+async def fetch_youtube(client, niches):
     if not YOUTUBE_API_KEY: return
     today = dt.date.today().isoformat()
-    rows=[]
-    for n in niches:
+    # pass 1: search.list per niche
+    async def search(n):
+        try:
+            return n, await yt_search_ids(client, n, DAYS)
+        except Exception as e:
+            await asyncio.to_thread(log_run, "youtube", "error", str(e))
+            return n, None
+    ids_by_niche = {n: ids for n, ids in await asyncio.gather(*(search(n) for n in niches)) if ids is not None}
+    # pass 2: one videos.list per 50 distinct ids across all niches
+    all_ids = list(dict.fromkeys(i for ids in ids_by_niche.values() for i in ids))
+    stats_by_id, failed = {}, set()
+    async def stats(batch):
         try:
-            v = yt_views_for_query(n, DAYS)
-            rows.append({"source":"youtube","niche":n,"date":today,"metric":"views_7d",
-                         "value":float(v),"geo":DEFAULT_GEO,"timeframe":f"last_{DAYS}d"})
+            stats_by_id.update(await yt_view_counts(client, batch))
         except Exception as e:
-            log_run("youtube","error",str(e))
-    upsert_points(rows); log_run("youtube")
+            failed.update(batch)
+            await asyncio.to_thread(log_run, "youtube", "error", str(e))
+    await asyncio.gather(*(stats(all_ids[i:i+50]) for i in range(0, len(all_ids), 50)))
+    rows = [{"source":"youtube","niche":n,"date":today,"metric":"views_7d",
+             "value":float(sum(stats_by_id.get(i, 0) for i in ids)),"geo":DEFAULT_GEO,"timeframe":f"last_{DAYS}d"}
+            for n, ids in ids_by_niche.items() if failed.isdisjoint(ids)]
+    await asyncio.to_thread(upsert_points, rows); await asyncio.to_thread(log_run, "youtube")
+
+# ---- Reddit (official OAuth API, app-only) ----
+def reddit_token():
+    r = http.post("https://www.reddit.com/api/v1/access_token",
+                  auth=(REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET), data={"grant_type":"client_credentials"},
+                  headers={"User-Agent":REDDIT_USER_AGENT}, timeout=30)
+    r.raise_for_status()
+    return r.json()["access_token"]
 
-# ---- Reddit (official API via PRAW) ----
 def fetch_reddit(niches):
     if not (REDDIT_CLIENT_ID and REDDIT_CLIENT_SECRET and REDDIT_USER_AGENT): return
-    import praw
-    reddit = praw.Reddit(
-        client_id=REDDIT_CLIENT_ID,
-        client_secret=REDDIT_CLIENT_SECRET,
-        user_agent=REDDIT_USER_AGENT,
-    )
-    cutoff = dt.datetime.utcnow() - dt.timedelta(days=DAYS)
+    try:
+        headers = {"Authorization":f"bearer {reddit_token()}", "User-Agent":REDDIT_USER_AGENT}
+    except Exception as e:
+        log_run("reddit","error",str(e)); return
+    cutoff_ts = (dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=DAYS)).timestamp()
     today = dt.date.today().isoformat()
-    rows=[]
-    for n in niches:
-        count = 0
-        for sub in SUBREDDITS:
-            try:
-                for post in reddit.subreddit(sub).search(n, sort="new", time_filter="week", limit=100):
-                    created = dt.datetime.utcfromtimestamp(post.created_utc)
-                    if created >= cutoff: count += 1
-            except Exception:
-                pass
-        rows.append({"source":"reddit","niche":n,"date":today,"metric":"posts_7d",
-                     "value":float(count),"geo":DEFAULT_GEO,"timeframe":f"last_{DAYS}d"})
+    def one(pair):
+        n, sub = pair
+        try:
+            params = {"q":n, "restrict_sr":1, "t":"week", "sort":"new", "limit":100}
+            r = http.get(f"https://oauth.reddit.com/r/{sub}/search", params=params, headers=headers, timeout=30).json()
+            count = 0
+            for c in r["data"]["children"]:
+                if c["data"]["created_utc"] < cutoff_ts: break  # sort=new: the rest are older
+                count += 1
+            return n, count
+        except Exception:
+            return n, 0
+    counts = dict.fromkeys(niches, 0)
+    with ThreadPoolExecutor(max_workers=WORKERS) as ex:
+        for n, c in ex.map(one, [(n, sub) for n in niches for sub in SUBREDDITS]):
+            counts[n] += c
+    rows = [{"source":"reddit","niche":n,"date":today,"metric":"posts_7d",
+             "value":float(c),"geo":DEFAULT_GEO,"timeframe":f"last_{DAYS}d"} for n, c in counts.items()]
     upsert_points(rows); log_run("reddit")
 
 # ---- News (NewsAPI) ----
-def fetch_news(niches):
+async def fetch_news(client, niches):
     if not NEWSAPI_KEY: return
     today = dt.date.today().isoformat()
     from_date = (dt.date.today()-dt.timedelta(days=DAYS)).isoformat()
-    rows=[]
-    for n in niches:
+    async def one(n):
         try:
             params={"q": n, "from": from_date, "language":"en", "pageSize": 100, "apiKey": NEWSAPI_KEY}
-            r = requests.get("https://newsapi.org/v2/everything", params=params, timeout=30).json()
+            r = await get_json(client, "https://newsapi.org/v2/everything", params)
             total = int(r.get("totalResults", 0))
-            rows.append({"source":"newsapi","niche":n,"date":today,"metric":"articles_7d",
-                         "value":float(total),"geo":DEFAULT_GEO,"timeframe":f"last_{DAYS}d"})
+            return {"source":"newsapi","niche":n,"date":today,"metric":"articles_7d",
+                    "value":float(total),"geo":DEFAULT_GEO,"timeframe":f"last_{DAYS}d"}
         except Exception as e:
-            log_run("newsapi","error",str(e))
-    upsert_points(rows); log_run("newsapi")
+            await asyncio.to_thread(log_run, "newsapi", "error", str(e))
+    rows = [r for r in await asyncio.gather(*(one(n) for n in niches)) if r]
+    await asyncio.to_thread(upsert_points, rows); await asyncio.to_thread(log_run, "newsapi")
 
 # ---- HN Algolia (no key) ----
-def fetch_hn(niches):
+async def fetch_hn(client, niches):
     today = dt.date.today().isoformat()
     since = int((dt.datetime.utcnow()-dt.timedelta(days=DAYS)).timestamp())
-    rows=[]
-    for n in niches:
+    async def one(n):
         try:
             url = "https://hn.algolia.com/api/v1/search_by_date?" + urlencode({
                 "query": n, "tags":"story", "numericFilters": f"created_at_i>{since}", "hitsPerPage": 1000
             })
-            r = requests.get(url, timeout=30).json()
-            rows.append({"source":"hn","niche":n,"date":today,"metric":"stories_7d",
-                         "value":float(len(r.get("hits",[]))),"geo":DEFAULT_GEO,"timeframe":f"last_{DAYS}d"})
+            r = await get_json(client, url)
+            return {"source":"hn","niche":n,"date":today,"metric":"stories_7d",
+                    "value":float(len(r.get("hits",[]))),"geo":DEFAULT_GEO,"timeframe":f"last_{DAYS}d"}
         except Exception as e:
-            log_run("hn","error",str(e))
-    upsert_points(rows); log_run("hn")
+            await asyncio.to_thread(log_run, "hn", "error", str(e))
+    rows = [r for r in await asyncio.gather(*(one(n) for n in niches)) if r]
+    await asyncio.to_thread(upsert_points, rows); await asyncio.to_thread(log_run, "hn")
+
+async def run_ingest():
+    # one HTTP/2 client multiplexes YouTube/News/HN; pytrends + Reddit stay on threads
+    limits = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+    async with httpx.AsyncClient(http2=True, limits=limits, timeout=30) as client:
+        await asyncio.gather(
+            asyncio.to_thread(fetch_google_trends, NICHES, TIMEFRAME, DEFAULT_GEO),
+            asyncio.to_thread(fetch_reddit, NICHES),
+            fetch_youtube(client, NICHES),
+            fetch_news(client, NICHES),
+            fetch_hn(client, NICHES),
+        )
 
 if __name__ == "__main__":
     ensure_schema()
-    fetch_google_trends(NICHES, TIMEFRAME, DEFAULT_GEO)
-    fetch_youtube(NICHES)
-    fetch_reddit(NICHES)
-    fetch_news(NICHES)
-    fetch_hn(NICHES)
+    asyncio.run(run_ingest())
+    with db() as conn:
+        conn.execute("ANALYZE trend_points")  # refresh planner stats after the bulk load
+        # once per run rather than per source: concurrent refreshes would just queue on the MV lock
+        conn.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY mv_trend_daily")
     print("Ingest complete.")
@@ -0,0 +1,43 @@
+# momentum.py
+# kept out of the Streamlit script so the compiled numba dispatcher survives reruns
+import warnings
+import numpy as np
+
+NUMBA_MIN_NICHES = 32
+_kernel = None  # momentum_numba.momentum_kernel once loaded, False if numba is missing
+
+def _momentum_numpy(P):
+    """Column-wise wow / slope7 / zscore90 / score for a ffilled (T, K) matrix."""
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN columns
+        cur7 = np.nanmean(P[-7:], axis=0)
+        prev7 = np.nanmean(P[-14:-7], axis=0)
+        wow = (cur7 - prev7) / np.where(prev7 != 0, prev7, np.nan)
+        # closed-form OLS slope over x = 0..6
+        x = np.arange(7, dtype=np.float64) - 3.0
+        last7 = P[-7:]
+        slope = (x @ (last7 - last7.mean(axis=0))) / (x**2).sum()
+        # z vs 90 (cap by length)
+        base = P[-90:]
+        sd = np.nanstd(base, axis=0)
+        z = (cur7 - np.nanmean(base, axis=0)) / np.where(sd > 0, sd, np.nan)
+    # niches with < 14 days of history get no stats
+    short = (~np.isnan(P)).sum(axis=0) < 14
+    wow[short] = slope[short] = z[short] = np.nan
+    score = (np.nan_to_num(np.tanh(wow))*0.45 + np.nan_to_num(np.tanh(slope/10))*0.35
+             + np.nan_to_num(np.tanh(z/3))*0.20)
+    score[short] = np.nan
+    return wow, slope, z, score
+
+def momentum_stats(P):
+    """wow / slope7 / zscore90 / score per column; numba kernel for wide matrices when available."""
+    global _kernel
+    if P.shape[1] >= NUMBA_MIN_NICHES:
+        if _kernel is None:
+            try:
+                from momentum_numba import momentum_kernel as _kernel
+            except ImportError:
+                _kernel = False
+        if _kernel:
+            return _kernel(np.ascontiguousarray(P))
+    return _momentum_numpy(P)
@@ -0,0 +1,38 @@
+# momentum_numba.py
+# imported lazily by momentum.py, only for wide niche matrices
+import numpy as np
+from numba import njit, prange
+
+# no "nnan" in fastmath: the kernel relies on NaN checks for leading gaps
+@njit(parallel=True, cache=True, fastmath={"nsz","arcp","contract","afn","reassoc"})
+def momentum_kernel(P):
+    """Same outputs as momentum._momentum_numpy, one streaming pass per column."""
+    T, K = P.shape
+    wow = np.full(K, np.nan); slope = np.full(K, np.nan)
+    z = np.full(K, np.nan); score = np.full(K, np.nan)
+    for k in prange(K):
+        n = 0; sum7 = 0.0; sum_prev7 = 0.0; sx_y = 0.0
+        ref = np.nan; sum90 = 0.0; sumsq90 = 0.0; n90 = 0
+        for t in range(T):
+            v = P[t, k]
+            if np.isnan(v): continue
+            n += 1
+            if t >= T - 90:
+                if n90 == 0: ref = v  # shift for a stable variance
+                d = v - ref
+                sum90 += d; sumsq90 += d*d; n90 += 1
+            if t >= T - 7:
+                sum7 += v; sx_y += (t - (T - 7) - 3.0)*v
+            elif t >= T - 14:
+                sum_prev7 += v
+        if n < 14: continue
+        cur7 = sum7/7.0; prev7 = sum_prev7/7.0
+        w = (cur7 - prev7)/prev7 if prev7 != 0 else np.nan
+        m = sx_y/28.0  # sxx for x = -3..3
+        mean90 = sum90/n90
+        var = sumsq90/n90 - mean90*mean90
+        zz = (cur7 - ref - mean90)/np.sqrt(var) if var > 0 else np.nan
+        wow[k] = w; slope[k] = m; z[k] = zz
+        score[k] = ((np.tanh(w)*0.45 if not np.isnan(w) else 0.0) + np.tanh(m/10)*0.35
+                    + (np.tanh(zz/3)*0.20 if not np.isnan(zz) else 0.0))
+    return wow, slope, z, score